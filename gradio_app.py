@@ -102,8 +102,8 @@ class AppState:
         if self.agent:
             try:
                 # Call the search_knowledge tool via the agent's internal method
-                # SyncAgent.agent = OmniTechAgent, SyncAgent.loop = event loop
-                result = self.agent.loop.run_until_complete(
+                # SyncAgent.agent = OmniTechAgent, SyncAgent.run() = run on its event loop
+                result = self.agent.run(
                     self.agent.agent.call_tool("search_knowledge", {
                         "query": query,
                         "max_results": max_results
@@ -124,7 +124,7 @@ class AppState:
                 if status:
                     args["status"] = status
 
-                result = self.agent.loop.run_until_complete(
+                result = self.agent.run(
                     self.agent.agent.call_tool("get_tickets", args)
                 )
                 return result.get("tickets", [])
@@ -399,7 +399,7 @@ def generate_mcp_monitor() -> str:
                     html += f"""
                     <div class="metric-card">
                         <strong>{entry['tool']}</strong>
-                        <span style="float: right; color: #64748b;">{entry['duration_ms']}ms</span>
+                        <span style="float: right; color: #64748b;">{'cached' if entry.get('cached') else str(entry['duration_ms']) + 'ms'}</span>
                         <p style="color: #64748b; font-size: 0.875rem;">
                             {entry['timestamp']} - {'✓' if entry['success'] else '✗'}
                         </p>
@@ -71,6 +71,7 @@ All print statements go to stderr to avoid corrupting the protocol.
 from __future__ import annotations  # Allows using class name in type hints before defined
 
 import asyncio          # Async/await support for non-blocking I/O
+import hashlib          # Fingerprinting PDFs to detect changes
 import json             # JSON parsing for tool arguments and results
 import logging          # Logging for debugging and monitoring
 import os               # Environment variables (HF_MODEL)
@@ -78,6 +79,7 @@ import re               # Regular expressions for text processing
 import sqlite3          # SQLite database for customers/orders/tickets
 import subprocess       # Not used, but available for future extensions
 import sys              # System-specific parameters (stderr, exit)
+from concurrent.futures import ProcessPoolExecutor  # Parallel PDF text extraction
 from datetime import datetime   # Timestamps for logging and tickets
 from pathlib import Path        # Cross-platform file path handling
 from typing import Any, Dict, List, Optional  # Type hints for better code clarity
@@ -100,11 +102,11 @@ except ImportError:
 # ─────────────────────────────────────────────────────────────────────────────
 # Vector Database and PDF Processing
 # ChromaDB: Vector database for semantic search (RAG retrieval)
-# pypdf: PDF text extraction for loading knowledge base
+# PyMuPDF: PDF text extraction for loading knowledge base (native MuPDF code)
 # ─────────────────────────────────────────────────────────────────────────────
 import chromadb                 # Vector database for embeddings and semantic search
 from chromadb.config import Settings  # ChromaDB configuration
-import pypdf                    # PDF text extraction
+import pymupdf                  # PDF text extraction
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Logging Configuration
@@ -141,6 +143,17 @@ logger = logging.getLogger("omnitech-support-mcp")
 # File Paths
 # Using Path objects (not strings) for cross-platform compatibility
 # ─────────────────────────────────────────────────────────────────────────────
+CHROMA_DIR = Path(".chroma")                      # Saved ChromaDB vector store
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Knowledge Base Chunking
+# The embedding model only reads the first ~512 tokens of a text, so each
+# PDF is split into overlapping chunks that are embedded (and retrieved)
+# separately. Changing these values re-embeds all PDFs on the next start.
+# ─────────────────────────────────────────────────────────────────────────────
+CHUNK_SIZE = 2000     # Characters per chunk (roughly 400-500 tokens)
+CHUNK_OVERLAP = 400   # Characters shared with the previous chunk
+WHITESPACE_RE = re.compile(r'\s+')  # Runs of whitespace collapsed in PDF text
 
 # ─────────────────────────────────────────────────────────────────────────────
 # LLM Configuration
@@ -302,6 +315,18 @@ Provide a helpful, professional response that addresses their needs.""",
     }
 }
 
+# ─────────────────────────────────────────────────────────────────────────────
+# PDF Text Extraction
+# A plain top-level function (not a method) so it can be sent to worker
+# processes - see OmniTechSupportServer._load_pdf_documents.
+# ─────────────────────────────────────────────────────────────────────────────
+def extract_pdf_text(file_path: Path) -> str:
+    """Extract the text of one PDF with whitespace cleaned up."""
+    with pymupdf.open(file_path) as pdf:
+        text = " ".join(page.get_text() for page in pdf)
+
+    return WHITESPACE_RE.sub(' ', text.strip())
+
 # ╔══════════════════════════════════════════════════════════════════════════╗
 # ║ SECTION 3: MCP SERVER CLASS                                              ║
 # ║                                                                          ║
@@ -507,47 +532,83 @@ class OmniTechSupportServer:
     #
     # ─────────────────────────────────────────────────────────────────────────
 
-    def _load_pdf_documents(self) -> List[Dict]:
-        """Load and parse PDF documents from knowledge base directory."""
+    def _load_pdf_documents(self, known_fingerprints: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """
+        Load and parse PDF documents from knowledge base directory.
+
+        Args:
+            known_fingerprints: {filename: fingerprint} of PDFs already in the
+                vector store. Unchanged files are skipped instead of parsed.
+        """
+        known_fingerprints = known_fingerprints or {}
         documents = []
 
         if not KNOWLEDGE_BASE_DIR.exists():
             logger.error(f"Knowledge base directory not found: {KNOWLEDGE_BASE_DIR}")
             return documents
 
-        for filename in os.listdir(KNOWLEDGE_BASE_DIR):
-            if not filename.endswith('.pdf'):
+        # First pass (cheap): fingerprint every PDF and keep only the ones
+        # that are new or changed since they were last embedded
+        to_parse = []  # (file_path, fingerprint)
+        for file_path in sorted(KNOWLEDGE_BASE_DIR.glob("*.pdf")):
+            filename = file_path.name
+
+            try:
+                # Fingerprint the file (and chunk settings) so unchanged PDFs
+                # aren't re-embedded
+                fingerprint = hashlib.sha256(
+                    file_path.read_bytes() + f"|{CHUNK_SIZE}|{CHUNK_OVERLAP}".encode()
+                ).hexdigest()
+            except OSError as e:
+                logger.error(f"Failed to load {filename}: {e}")
                 continue
 
-            file_path = KNOWLEDGE_BASE_DIR / filename
+            if known_fingerprints.get(filename) == fingerprint:
+                logger.info(f"Up to date: {filename}")
+                continue
 
-            # Determine category from filename
-            category = "general_support"
-            for cat, files in DOCUMENT_CATEGORIES.items():
-                if filename in files:
-                    category = cat
-                    break
+            to_parse.append((file_path, fingerprint))
 
-            try:
-                with open(file_path, 'rb') as f:
-                    pdf_reader = pypdf.PdfReader(f)
-                    text = ""
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + " "
-
-                text = re.sub(r'\s+', ' ', text.strip())
-
-                documents.append({
-                    "id": filename.replace('.pdf', ''),
-                    "text": text,
-                    "category": category,
-                    "source": filename
-                })
+        if not to_parse:
+            return documents
 
-                logger.info(f"Loaded: {filename} -> {category} ({len(text)} chars)")
+        # Second pass (expensive): extract text in parallel, one worker
+        # process per PDF so every core is used
+        workers = min(len(to_parse), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(extract_pdf_text, file_path)
+                for file_path, _ in to_parse
+            ]
 
-            except Exception as e:
-                logger.error(f"Failed to load {filename}: {e}")
+            for (file_path, fingerprint), future in zip(to_parse, futures):
+                filename = file_path.name
+                try:
+                    text = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to load {filename}: {e}")
+                    continue
+
+                # Determine category from filename
+                category = "general_support"
+                for cat, files in DOCUMENT_CATEGORIES.items():
+                    if filename in files:
+                        category = cat
+                        break
+
+                # Split into overlapping chunks, e.g. "OmniTech_Returns_Policy_2024::0"
+                step = CHUNK_SIZE - CHUNK_OVERLAP
+                starts = range(0, max(len(text) - CHUNK_OVERLAP, 1), step)
+                for idx, start in enumerate(starts):
+                    documents.append({
+                        "id": f"{filename.replace('.pdf', '')}::{idx}",
+                        "text": text[start:start + CHUNK_SIZE],
+                        "category": category,
+                        "source": filename,
+                        "fingerprint": fingerprint
+                    })
+
+                logger.info(f"Loaded: {filename} -> {category} ({len(text)} chars, {len(starts)} chunks)")
 
         return documents
 
@@ -555,28 +616,52 @@ class OmniTechSupportServer:
         """Initialize ChromaDB and load documents."""
         logger.info("Initializing knowledge base...")
 
-        self.chroma_client = chromadb.Client(Settings(anonymized_telemetry=False))
+        # Persistent client: embeddings are saved in CHROMA_DIR and reused on
+        # the next start instead of re-embedding every PDF
+        self.chroma_client = chromadb.PersistentClient(
+            path=str(CHROMA_DIR),
+            settings=Settings(anonymized_telemetry=False)
+        )
+
+        self.knowledge_base = self.chroma_client.get_or_create_collection("omnitech_knowledge")
 
-        try:
-            self.chroma_client.delete_collection("omnitech_knowledge")
-        except:
-            pass
+        # Which PDFs (and which versions of them) are already embedded?
+        stored = self.knowledge_base.get(include=["metadatas"])
+        known_fingerprints = {
+            meta["source"]: meta.get("fingerprint")
+            for meta in stored["metadatas"] if meta
+        }
+
+        # Remove documents whose PDF has been deleted
+        on_disk = {p.name for p in KNOWLEDGE_BASE_DIR.glob("*.pdf")}
+        for source in set(known_fingerprints) - on_disk:
+            self.knowledge_base.delete(where={"source": source})
 
-        self.knowledge_base = self.chroma_client.create_collection("omnitech_knowledge")
+        # Load only new or changed PDFs
+        documents = self._load_pdf_documents(known_fingerprints)
 
-        documents = self._load_pdf_documents()
+        # Drop the old chunks of any changed PDF
+        for source in {doc["source"] for doc in documents}:
+            if source in known_fingerprints:
+                self.knowledge_base.delete(where={"source": source})
 
-        for doc in documents:
+        # Add everything in one call so the embedding model sees a single batch
+        if documents:
             self.knowledge_base.add(
-                documents=[doc["text"]],
+                documents=[doc["text"] for doc in documents],
                 metadatas=[{
                     "category": doc["category"],
-                    "source": doc["source"]
-                }],
-                ids=[doc["id"]]
+                    "source": doc["source"],
+                    "fingerprint": doc["fingerprint"]
+                } for doc in documents],
+                ids=[doc["id"] for doc in documents]
             )
+        # Nothing new to embed: run one throwaway search instead, so the
+        # embedding model is loaded and warmed up before the first real query
+        elif self.knowledge_base.count():
+            self.knowledge_base.query(query_texts=["warmup"], n_results=1)
 
-        logger.info(f"Knowledge base ready: {self.knowledge_base.count()} documents")
+        logger.info(f"Knowledge base ready: {self.knowledge_base.count()} chunks")
 
     # ─────────────────────────────────────────────────────────────────────────
     # Classification Tool Handlers
@@ -695,12 +780,47 @@ class OmniTechSupportServer:
             include=["documents", "metadatas", "distances"]
         )
 
+        result = self._build_search_result(results, 0, query, category)
+
+        self._log_request("search_knowledge", arguments, result)
+        return [TextContent(type="text", text=json.dumps(result))]
+
+    async def _handle_search_knowledge_batch(self, arguments: Dict[str, Any]) -> List[TextContent]:
+        """Search knowledge base for several queries at once (one embedding pass)."""
+        queries = arguments.get("queries", [])
+        category = arguments.get("category", None)
+        max_results = arguments.get("max_results", 3)
+
+        where_clause = {"category": category} if category else None
+
+        # ChromaDB embeds all query texts together and returns one row per query
+        results = self.knowledge_base.query(
+            query_texts=queries,
+            n_results=max_results,
+            where=where_clause,
+            include=["documents", "metadatas", "distances"]
+        ) if queries else None
+
+        result = {
+            "results": [
+                self._build_search_result(results, i, query, category)
+                for i, query in enumerate(queries)
+            ],
+            "count": len(queries)
+        }
+
+        self._log_request("search_knowledge_batch", arguments, result)
+        return [TextContent(type="text", text=json.dumps(result))]
+
+    def _build_search_result(self, results: Dict[str, Any], index: int,
+                             query: str, category: Optional[str]) -> Dict[str, Any]:
+        """Turn row `index` of a ChromaDB query result into a search result."""
         matches = []
-        if results["documents"] and results["documents"][0]:
+        if results["documents"] and results["documents"][index]:
             for doc, meta, dist in zip(
-                results["documents"][0],
-                results["metadatas"][0],
-                results["distances"][0]
+                results["documents"][index],
+                results["metadatas"][index],
+                results["distances"][index]
             ):
                 matches.append({
                     "content": doc[:500] + "..." if len(doc) > 500 else doc,
@@ -710,16 +830,13 @@ class OmniTechSupportServer:
                     "similarity": round(1 - dist, 3) if dist < 1 else 0
                 })
 
-        result = {
+        return {
             "matches": matches,
             "count": len(matches),
             "query": query,
             "category_filter": category
         }
 
-        self._log_request("search_knowledge", arguments, result)
-        return [TextContent(type="text", text=json.dumps(result))]
-
     async def _handle_get_knowledge_for_query(self, arguments: Dict[str, Any]) -> List[TextContent]:
         """Get concatenated knowledge for a category and query."""
         category = arguments.get("category", "")
@@ -877,6 +994,7 @@ class OmniTechSupportServer:
                 "get_query_template",
                 "list_categories",
                 "search_knowledge",
+                "search_knowledge_batch",
                 "get_knowledge_for_query",
                 "lookup_customer",
                 "create_support_ticket",
@@ -1022,6 +1140,19 @@ class OmniTechSupportServer:
                         "required": ["query"]
                     }
                 ),
+                Tool(
+                    name="search_knowledge_batch",
+                    description="Search the knowledge base for several queries in one call",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "queries": {"type": "array", "items": {"type": "string"}, "description": "Search queries"},
+                            "category": {"type": "string", "description": "Optional category filter"},
+                            "max_results": {"type": "integer", "default": 3}
+                        },
+                        "required": ["queries"]
+                    }
+                ),
                 Tool(
                     name="get_knowledge_for_query",
                     description="Get concatenated knowledge for a category and query",
@@ -1096,6 +1227,8 @@ class OmniTechSupportServer:
                     return await self._handle_list_categories(arguments)
                 elif name == "search_knowledge":
                     return await self._handle_search_knowledge(arguments)
+                elif name == "search_knowledge_batch":
+                    return await self._handle_search_knowledge_batch(arguments)
                 elif name == "get_knowledge_for_query":
                     return await self._handle_get_knowledge_for_query(arguments)
                 elif name == "lookup_customer":
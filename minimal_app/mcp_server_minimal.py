@@ -13,6 +13,8 @@ Perfect for learning how MCP servers work!
 
 import asyncio
 import json
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 from mcp.server import Server
 from mcp.types import Tool, TextContent
@@ -43,6 +45,118 @@ EMAILS, ORDERS = load_data()
 # Print status
 print(f"Loaded {len(EMAILS)} emails and {len(ORDERS)} orders from {DATA_FILE.name}")
 
+# ═══════════════════════════════════════════════════════════════════════════
+# SEARCH INDEX
+# ═══════════════════════════════════════════════════════════════════════════
+
+def trigrams(text):
+    """Return every 3-character chunk of text (e.g. "ship" -> {"shi", "hip"})"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    """
+    A tiny inverted index over a list of records.
+
+    Instead of lowercasing and scanning every field of every record on each
+    query, we lowercase the searchable text once at startup and remember
+    which records contain each trigram. A query then only has to look at the
+    records that contain ALL of its trigrams.
+    """
+
+    def __init__(self, records, fields):
+        # Records and their search blobs are kept in parallel lists, so
+        # searching scans plain strings and never looks inside the dicts
+        self.records = records
+
+        # One pre-lowercased search string per record. Fields are joined with
+        # newlines so a (single-line) query can never match across two fields.
+        self.blobs = ["\n".join(r.get(f, "") for f in fields).lower() for r in records]
+
+        # trigram -> set of record positions containing it
+        self.postings = defaultdict(set)
+        for i, blob in enumerate(self.blobs):
+            for gram in trigrams(blob):
+                self.postings[gram].add(i)
+
+    def search(self, query):
+        """Return records where the (lowercased) query appears in any field"""
+        grams = trigrams(query)
+        if not grams:
+            # Queries shorter than 3 characters can't use the index, so walk
+            # the blob list directly and only touch a record when it matches
+            return [
+                record for record, blob in zip(self.records, self.blobs)
+                if query in blob
+            ]
+
+        # Only records sharing every trigram with the query can match
+        candidates = sorted(set.intersection(
+            *(self.postings.get(gram, set()) for gram in grams)
+        ))
+
+        # Confirm the real substring match on the few candidates left
+        return [self.records[i] for i in candidates if query in self.blobs[i]]
+
+# Build the indexes once, when the server starts
+EMAIL_INDEX = SearchIndex(EMAILS, ("customer_email", "subject", "body", "status"))
+ORDER_INDEX = SearchIndex(ORDERS, ("order_id", "customer_email", "product", "status"))
+
+# How each search result is shown to the LLM
+EMAIL_TEMPLATE = (
+    "ID: {id}\n"
+    "From: {customer_email}\n"
+    "Subject: {subject}\n"
+    "Date: {date}\n"
+    "Status: {status}\n"
+    "Body: {body}\n"
+    + "-" * 50 + "\n\n"
+)
+
+ORDER_TEMPLATE = (
+    "Order ID: {order_id}\n"
+    "Customer: {customer_email}\n"
+    "Product: {product}\n"
+    "Price: {price}\n"
+    "Order Date: {order_date}\n"
+    "Status: {status}\n"
+    "Tracking: {tracking}\n"
+    + "-" * 50 + "\n\n"
+)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# SEARCH FUNCTIONS
+# ═══════════════════════════════════════════════════════════════════════════
+
+# The same questions come in again and again, so the formatted answer for
+# each recent query is remembered. If the data is ever reloaded while the
+# server runs, call search_emails.cache_clear() / search_orders.cache_clear().
+
+@lru_cache(maxsize=256)
+def search_emails(query):
+    """Search emails for a lowercased query and format the results as text"""
+    results = EMAIL_INDEX.search(query)
+
+    if not results:
+        return f"No emails found matching: {query}"
+
+    # Format the results nicely
+    return f"Found {len(results)} email(s):\n\n" + "".join(
+        EMAIL_TEMPLATE.format_map(email) for email in results
+    )
+
+@lru_cache(maxsize=256)
+def search_orders(query):
+    """Search orders for a lowercased query and format the results as text"""
+    results = ORDER_INDEX.search(query)
+
+    if not results:
+        return f"No orders found matching: {query}"
+
+    # Format the results nicely
+    return f"Found {len(results)} order(s):\n\n" + "".join(
+        ORDER_TEMPLATE.format_map(order) for order in results
+    )
+
 # ═══════════════════════════════════════════════════════════════════════════
 # MCP SERVER SETUP
 # ═══════════════════════════════════════════════════════════════════════════
@@ -95,62 +209,11 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
 
     if name == "search_emails":
         query = arguments.get("query", "").lower()
-
-        # Search through all emails
-        results = []
-        for email in EMAILS:
-            # Check if query matches any field
-            if (query in email["customer_email"].lower() or
-                query in email["subject"].lower() or
-                query in email["body"].lower() or
-                query in email.get("status", "").lower()):
-                results.append(email)
-
-        if results:
-            # Format the results nicely
-            formatted = f"Found {len(results)} email(s):\n\n"
-            for email in results:
-                formatted += f"ID: {email['id']}\n"
-                formatted += f"From: {email['customer_email']}\n"
-                formatted += f"Subject: {email['subject']}\n"
-                formatted += f"Date: {email['date']}\n"
-                formatted += f"Status: {email['status']}\n"
-                formatted += f"Body: {email['body']}\n"
-                formatted += "-" * 50 + "\n\n"
-
-            return [TextContent(type="text", text=formatted)]
-        else:
-            return [TextContent(type="text", text=f"No emails found matching: {query}")]
+        return [TextContent(type="text", text=search_emails(query))]
 
     elif name == "search_orders":
         query = arguments.get("query", "").lower()
-
-        # Search through all orders
-        results = []
-        for order in ORDERS:
-            # Check if query matches any field
-            if (query in order["order_id"].lower() or
-                query in order["customer_email"].lower() or
-                query in order["product"].lower() or
-                query in order["status"].lower()):
-                results.append(order)
-
-        if results:
-            # Format the results nicely
-            formatted = f"Found {len(results)} order(s):\n\n"
-            for order in results:
-                formatted += f"Order ID: {order['order_id']}\n"
-                formatted += f"Customer: {order['customer_email']}\n"
-                formatted += f"Product: {order['product']}\n"
-                formatted += f"Price: {order['price']}\n"
-                formatted += f"Order Date: {order['order_date']}\n"
-                formatted += f"Status: {order['status']}\n"
-                formatted += f"Tracking: {order['tracking']}\n"
-                formatted += "-" * 50 + "\n\n"
-
-            return [TextContent(type="text", text=formatted)]
-        else:
-            return [TextContent(type="text", text=f"No orders found matching: {query}")]
+        return [TextContent(type="text", text=search_orders(query))]
 
     else:
         return [TextContent(type="text", text=f"Unknown tool: {name}")]
@@ -20,13 +20,21 @@ Perfect for learning how real RAG + MCP work together!
 import os
 import re
 import json
+import asyncio
+import time
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from huggingface_hub import InferenceClient
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 import chromadb
 from chromadb.utils import embedding_functions
-import pypdf
+import numpy as np
+import pymupdf
 
 # ═══════════════════════════════════════════════════════════════════════════
 # CONFIGURATION
@@ -43,9 +51,45 @@ if not HF_TOKEN:
     print("Get a token from: https://huggingface.co/settings/tokens")
     print()
 
+# Set SKIP_WARMUP=1 to skip the startup LLM warm-up ping (e.g. in CI, or
+# when the model is known to be loaded already)
+LLM_WARMUP = os.environ.get("SKIP_WARMUP") != "1"
+
 # Knowledge base directory - where the PDF files live (in parent directory)
 KNOWLEDGE_BASE_DIR = Path(__file__).parent.parent / "knowledge_base_pdfs"
 
+# Where ChromaDB saves its vector store between runs, so PDFs are only
+# parsed and embedded again when they change
+CHROMA_DIR = Path(__file__).parent / ".chroma"
+
+# Caching - support customers ask the same questions a lot, so remember
+# recent knowledge base searches and LLM answers instead of redoing them
+SEARCH_CACHE_SIZE = 512   # Knowledge base searches to remember
+LLM_CACHE_SIZE = 128      # LLM responses to remember
+LLM_CACHE_TTL = 300       # Seconds before a cached LLM response goes stale
+
+# Semantic cache - a question that MEANS the same as a recent one ("How do I
+# reset my password?" vs "how can I reset my password") reuses its answer.
+# Off by default: set SEMANTIC_CACHE=1 to try it. Reusing an answer for a
+# *different* question is only safe if the threshold is right for your data.
+# 0.95 was picked by hand as a cautious starting point, not measured - check
+# it against pairs of real questions (same meaning / different meaning)
+# before turning the cache on.
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_SIZE = 64          # Recent answers to compare against
+SEMANTIC_CACHE_THRESHOLD = 0.95   # Cosine similarity needed to reuse one
+
+# PDF chunking - embedding models only read the first ~512 tokens of a text,
+# so each PDF is split into overlapping chunks that are embedded separately
+CHUNK_SIZE = 2000     # Characters per chunk (roughly 400-500 tokens)
+CHUNK_OVERLAP = 400   # Characters shared with the previous chunk
+
+# Prompt budgets - rough caps (about 4 characters per token) on each part of
+# the LLM prompt, so one oversized search result can't balloon every request
+DOCS_CHAR_BUDGET = 4800      # Knowledge base documentation (~1200 tokens)
+TOOLS_CHAR_BUDGET = 1600     # Email / order search results (~400 tokens)
+HISTORY_CHAR_BUDGET = 1200   # Previous conversation (~300 tokens)
+
 # ═══════════════════════════════════════════════════════════════════════════
 # CLASSIFICATION KEYWORDS (for determining query category)
 # ═══════════════════════════════════════════════════════════════════════════
@@ -71,25 +115,137 @@ CATEGORY_KEYWORDS = {
     ]
 }
 
-def classify_query(query: str) -> tuple[str, str]:
+# One pattern per category, so each category is a single scan of the query.
+# Categories are still tried in order, so the first one that matches wins.
+CATEGORY_PATTERNS = {
+    category: re.compile("|".join(map(re.escape, keywords)))
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+# Words that mean a question needs the MCP email / order search tools
+EMAIL_TRIGGERS = ("email", "conversation", "ticket", "support history")
+ORDER_TRIGGERS = ("order", "shipping", "delivery", "tracking", "ord-")
+
+def classify_query(query_lower: str) -> tuple[str, str]:
     """
     Classify a query into a category based on keywords.
 
+    Args:
+        query_lower: The user's message, already lowercased
+
     Returns:
         Tuple of (workflow_type, category_name)
         workflow_type: "classification" or "direct_rag"
         category_name: The detected category or "general_inquiry"
     """
-    query_lower = query.lower()
-
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in query_lower:
-                return ("classification", category)
+    for category, pattern in CATEGORY_PATTERNS.items():
+        if pattern.search(query_lower):
+            return ("classification", category)
 
     # No specific category matched - use direct RAG
     return ("direct_rag", "general_inquiry")
 
+def needs_knowledge_base(query: str, workflow_type: str) -> bool:
+    """
+    Decide whether a message is worth a knowledge base search.
+
+    Short chit-chat like "hi" or "thanks!" has nothing to look up, so we
+    skip the vector search for it. Anything with a support keyword, a
+    question mark, or more than a few words still gets searched.
+    """
+    return workflow_type == "classification" or "?" in query or len(query) > 20
+
+# ═══════════════════════════════════════════════════════════════════════════
+# TEXT PATTERNS (compiled once, reused for every query)
+# ═══════════════════════════════════════════════════════════════════════════
+
+EMAIL_RE = re.compile(r'[\w\.-]+@[\w\.-]+')          # Email address in a question
+ORDER_ID_RE = re.compile(r'ORD-\d+', re.IGNORECASE)  # Order ID like ORD-1001
+
+# One pattern per trigger list, so checking a question is a single scan
+EMAIL_TRIGGER_RE = re.compile("|".join(map(re.escape, EMAIL_TRIGGERS)))
+ORDER_TRIGGER_RE = re.compile("|".join(map(re.escape, ORDER_TRIGGERS)))
+
+# Leftover ``` markers when an LLM reply has no usable JSON
+CODE_FENCE_RE = re.compile(r'```(?:json)?|```')
+
+# Words with a digit in them - order numbers, model numbers, quantities. Two
+# questions only share a semantic cache entry if these match exactly.
+ENTITY_RE = re.compile(r'[\w-]*\d[\w-]*')
+
+JSON_DECODER = json.JSONDecoder()
+
+def prompt_key(prompt: str) -> str:
+    """Cache key for an LLM prompt (see SyncAgent.query_llm)."""
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+def extract_json(text: str):
+    """
+    Find the {"response": ...} object in an LLM reply.
+
+    LLMs often wrap their JSON in ```json fences or add a sentence around
+    it, so instead of parsing the whole reply we decode from each "{" in
+    turn. raw_decode stops at the end of the object and ignores whatever
+    follows it.
+
+    Returns:
+        The decoded dict, or None if the reply has no such object
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = JSON_DECODER.raw_decode(text, start)
+            if isinstance(obj, dict) and "response" in obj:
+                return obj
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+def fit_to_budget(text: str, max_chars: int) -> str:
+    """
+    Shorten text to at most max_chars, cutting at a word boundary.
+
+    Returns:
+        The text unchanged if it already fits, otherwise the trimmed text
+        ending in "..."
+    """
+    if len(text) <= max_chars:
+        return text
+
+    cut = text.rfind(" ", 0, max_chars - 3)
+    return text[:cut if cut > 0 else max_chars - 3] + "..."
+
+def drain_stream(stream) -> None:
+    """
+    Read an LLM stream to the end and throw the rest away.
+
+    The HTTP connection behind a stream only goes back to the pool (to be
+    reused by the next request) once the whole response has been read.
+    """
+    try:
+        for _ in stream:
+            pass
+    except Exception:
+        pass  # The answer was already returned - nothing left to report
+
+# ═══════════════════════════════════════════════════════════════════════════
+# PDF TEXT EXTRACTION
+# ═══════════════════════════════════════════════════════════════════════════
+
+def extract_pdf_text(file_path: Path) -> str:
+    """
+    Extract the text of one PDF with whitespace cleaned up.
+
+    This is a plain top-level function (not a method) so it can run in a
+    separate worker process - see SyncAgent._load_pdf_documents.
+    """
+    with pymupdf.open(file_path) as pdf:
+        text = " ".join(page.get_text() for page in pdf)
+
+    # Clean up whitespace (split() drops every run of spaces/newlines)
+    return ' '.join(text.split())
+
 # ═══════════════════════════════════════════════════════════════════════════
 # AGENT CLASS
 # ═══════════════════════════════════════════════════════════════════════════
@@ -111,25 +267,56 @@ class SyncAgent:
         self.verbose = verbose
 
         # Conversation history for multi-turn context
-        # Stores recent exchanges as list of {"user": str, "assistant": str}
-        self.conversation_history = []
+        # Stores recent exchanges as {"user": str, "assistant": str} dicts.
+        # A deque with maxlen drops the oldest exchange by itself on append.
         self.max_history = 3  # Keep last 3 exchanges for context
+        self.conversation_history = deque(maxlen=self.max_history)
 
         # Initialize vector store
         self._setup_vector_store()
 
+        # Caches for repeated questions (see search_knowledge_base / query_llm)
+        self._cached_search = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._search_collection)
+        self._cached_embed = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._embed_query)
+        self._llm_cache = {}  # prompt hash -> (timestamp, response text)
+        self._semantic_cache = deque(maxlen=SEMANTIC_CACHE_SIZE)  # (query embedding, entities, answer)
+
+        # Wake the LLM up in the background while the user types
+        if HF_CLIENT and LLM_WARMUP:
+            threading.Thread(target=self._warm_up_llm, daemon=True).start()
+
         # MCP session (will be set when connecting)
         self.mcp_session = None
         self.mcp_tools = []
 
+    def _warm_up_llm(self):
+        """
+        Send a tiny request so the HTTPS connection is open and the model is
+        loaded (no 503 "warming up") by the time the first real question comes.
+        """
+        try:
+            HF_CLIENT.chat_completion(
+                messages=[{"role": "user", "content": "ping"}],
+                model=HF_MODEL,
+                max_tokens=1
+            )
+        except Exception:
+            pass  # Just a warm-up - query_llm reports real errors
+
     def clear_history(self):
         """Clear conversation history to start fresh."""
-        self.conversation_history = []
+        self.conversation_history.clear()
         if self.verbose:
             print("[HISTORY] Conversation history cleared")
 
-    def _load_pdf_documents(self):
-        """Load and parse PDF documents from knowledge base directory."""
+    def _load_pdf_documents(self, known_fingerprints=None):
+        """Load PDF documents from knowledge base directory and split them into chunks.
+
+        Args:
+            known_fingerprints: Optional {filename: fingerprint} of PDFs already
+                in the vector store. Unchanged files are skipped instead of parsed.
+        """
+        known_fingerprints = known_fingerprints or {}
         documents = []
 
         if not KNOWLEDGE_BASE_DIR.exists():
@@ -139,72 +326,111 @@ class SyncAgent:
 
         print(f"Loading PDFs from: {KNOWLEDGE_BASE_DIR}")
 
-        for filename in os.listdir(KNOWLEDGE_BASE_DIR):
-            if not filename.endswith('.pdf'):
+        # First pass: find the PDFs that are new or changed since last run
+        to_parse = []  # (filename, fingerprint)
+        for file_path in sorted(KNOWLEDGE_BASE_DIR.glob("*.pdf")):
+            filename = file_path.name
+
+            try:
+                # Fingerprint the file contents AND chunk settings, so changing
+                # either one re-embeds the PDF
+                fingerprint = hashlib.sha256(
+                    file_path.read_bytes() + f"|{CHUNK_SIZE}|{CHUNK_OVERLAP}".encode()
+                ).hexdigest()
+            except OSError as e:
+                print(f"  ✗ Failed to load {filename}: {e}")
+                continue
+
+            # Already embedded and unchanged since last run - nothing to do
+            if known_fingerprints.get(filename) == fingerprint:
+                print(f"  ✓ Up to date: {filename}")
                 continue
 
-            file_path = KNOWLEDGE_BASE_DIR / filename
+            to_parse.append((filename, fingerprint))
 
-            try:
-                with open(file_path, 'rb') as f:
-                    pdf_reader = pypdf.PdfReader(f)
-                    text = ""
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + " "
-
-                # Clean up whitespace
-                text = re.sub(r'\s+', ' ', text.strip())
-
-                documents.append({
-                    "id": filename.replace('.pdf', ''),
-                    "text": text,
-                    "source": filename
-                })
+        if not to_parse:
+            return documents
 
-                print(f"  ✓ Loaded: {filename} ({len(text)} chars)")
+        # Second pass: extract text from those PDFs in parallel, one worker
+        # process per file (text extraction is CPU-heavy)
+        workers = min(len(to_parse), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(extract_pdf_text, KNOWLEDGE_BASE_DIR / filename)
+                for filename, _ in to_parse
+            ]
 
-            except Exception as e:
-                print(f"  ✗ Failed to load {filename}: {e}")
+            for (filename, fingerprint), future in zip(to_parse, futures):
+                try:
+                    text = future.result()
+                except Exception as e:
+                    print(f"  ✗ Failed to load {filename}: {e}")
+                    continue
+
+                # Split into overlapping chunks, e.g. "OmniTech_Returns_Policy_2024::0"
+                step = CHUNK_SIZE - CHUNK_OVERLAP
+                starts = range(0, max(len(text) - CHUNK_OVERLAP, 1), step)
+                for idx, start in enumerate(starts):
+                    documents.append({
+                        "id": f"{filename.replace('.pdf', '')}::{idx}",
+                        "text": text[start:start + CHUNK_SIZE],
+                        "source": filename,
+                        "fingerprint": fingerprint
+                    })
+
+                print(f"  ✓ Loaded: {filename} ({len(text)} chars, {len(starts)} chunks)")
 
         return documents
 
     def _setup_vector_store(self):
         """Set up ChromaDB with PDF documentation (real RAG!)"""
 
-        # Create ChromaDB client
-        chroma_client = chromadb.Client()
+        # Create ChromaDB client that saves to disk (CHROMA_DIR)
+        chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
 
-        # Use default embedding function
-        embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        # Use default embedding function (kept on the agent, since
+        # search_knowledge_base embeds questions with it too)
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
 
-        # Try to delete old collection if it exists
-        try:
-            chroma_client.delete_collection("omnitech_docs_minimal")
-        except:
-            pass
-
-        # Create fresh collection
-        self.collection = chroma_client.create_collection(
+        # Reuse the collection from the last run if there is one
+        self.collection = chroma_client.get_or_create_collection(
             name="omnitech_docs_minimal",
-            embedding_function=embedding_function
+            embedding_function=self.embedding_function
         )
 
-        # Load PDF documents
-        documents = self._load_pdf_documents()
+        # Which PDFs (and which versions of them) are already embedded?
+        stored = self.collection.get(include=["metadatas"])
+        known_fingerprints = {
+            meta["source"]: meta.get("fingerprint")
+            for meta in stored["metadatas"] if meta
+        }
+
+        # Remove documents whose PDF has been deleted
+        on_disk = {p.name for p in KNOWLEDGE_BASE_DIR.glob("*.pdf")}
+        for source in set(known_fingerprints) - on_disk:
+            self.collection.delete(where={"source": source})
 
-        if not documents:
+        # Load only new or changed PDF documents
+        documents = self._load_pdf_documents(known_fingerprints)
+
+        if not documents and not self.collection.count():
             print("✗ No documents loaded! RAG will not work properly.")
             return
 
-        # Add documents to vector store
-        for doc in documents:
+        # Drop the old chunks of any PDF that changed
+        for source in {doc["source"] for doc in documents}:
+            if source in known_fingerprints:
+                self.collection.delete(where={"source": source})
+
+        # Add all documents in one call so they're embedded as a single batch
+        if documents:
             self.collection.add(
-                documents=[doc["text"]],
-                metadatas=[{"source": doc["source"]}],
-                ids=[doc["id"]]
+                documents=[doc["text"] for doc in documents],
+                metadatas=[{"source": doc["source"], "fingerprint": doc["fingerprint"]} for doc in documents],
+                ids=[doc["id"] for doc in documents]
             )
 
-        print(f"✓ Knowledge base ready: {self.collection.count()} documents loaded")
+        print(f"✓ Knowledge base ready: {self.collection.count()} chunks loaded")
 
     async def connect_mcp(self):
         """Connect to the MCP server to access email/order tools"""
@@ -229,6 +455,11 @@ class SyncAgent:
 
         print(f"✓ Connected to MCP server with {len(self.mcp_tools)} tools")
 
+    async def _call_search_tool(self, tool_name: str, search_query: str) -> str:
+        """Call one of the MCP search tools and return its text result."""
+        result = await self.mcp_session.call_tool(tool_name, {"query": search_query})
+        return result.content[0].text
+
     async def cleanup(self):
         """Clean up MCP connection"""
         if self.mcp_session:
@@ -248,8 +479,24 @@ class SyncAgent:
             Relevant documentation as a string
         """
 
+        # Normalize the query so "Reset password" and "reset  password"
+        # share one cache entry (the embedding model is lowercase anyway)
+        query_norm = " ".join(query.lower().split())
+        return self._cached_search(query_norm, n_results)
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a normalized question as a unit vector (cached as _cached_embed)."""
+        vector = np.asarray(self.embedding_function([query])[0], dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _search_collection(self, query: str, n_results: int) -> str:
+        """Run the actual vector search (cached by search_knowledge_base)."""
+
+        # Embed the question ourselves (once) and hand Chroma the vector
+        query_embedding = self._cached_embed(query)
+
         results = self.collection.query(
-            query_texts=[query],
+            query_embeddings=[query_embedding.tolist()],
             n_results=n_results
         )
 
@@ -265,6 +512,30 @@ class SyncAgent:
         context = "\n\n---\n\n".join(docs_with_sources)
         return context
 
+    def _semantic_lookup(self, query_embedding: np.ndarray, entities: frozenset):
+        """
+        Find a recent answer to a question that means the same thing.
+
+        Only questions mentioning exactly the same entities (see ENTITY_RE)
+        are compared, so "status of ORD-1001" never reuses the answer about
+        ORD-1002 however similar the wording.
+
+        Returns:
+            The cached answer, or None if no recent question is similar enough
+        """
+        candidates = [(vector, answer) for vector, cached_entities, answer in self._semantic_cache
+                      if cached_entities == entities]
+        if not candidates:
+            return None
+
+        # All vectors are unit length, so a dot product is the cosine similarity
+        vectors = np.stack([vector for vector, _ in candidates])
+        scores = vectors @ query_embedding
+        best = int(scores.argmax())
+        if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return candidates[best][1]
+        return None
+
     def query_llm(self, prompt: str) -> str:
         """
         Query Hugging Face LLM to generate a response.
@@ -284,17 +555,45 @@ class SyncAgent:
                 "confidence": 0.5
             })
 
+        # Reuse a recent answer to the exact same prompt
+        cache_key = prompt_key(prompt)
+        cached = self._llm_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < LLM_CACHE_TTL:
+            return cached[1]
+
         try:
-            # Use chat_completion for instruct models
-            response = HF_CLIENT.chat_completion(
+            # Use chat_completion for instruct models, streaming the answer
+            # back token by token instead of waiting for all of it
+            stream = HF_CLIENT.chat_completion(
                 messages=[{"role": "user", "content": prompt}],
                 model=HF_MODEL,
                 max_tokens=500,
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
 
-            # Extract the response text
-            result_text = response.choices[0].message.content
+            # Collect the response text
+            result_text = ""
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content or ""
+                result_text += token
+
+                # Stop as soon as the JSON answer is complete - anything the
+                # model writes after it would be thrown away anyway. The rest
+                # of the stream is read in the background so its connection
+                # can be reused.
+                if "}" in token and extract_json(result_text) is not None:
+                    threading.Thread(target=drain_stream, args=(stream,), daemon=True).start()
+                    break
+
+            # Remember it (dropping the oldest entry when the cache is full)
+            self._llm_cache.pop(cache_key, None)
+            self._llm_cache[cache_key] = (time.monotonic(), result_text)
+            if len(self._llm_cache) > LLM_CACHE_SIZE:
+                del self._llm_cache[next(iter(self._llm_cache))]
+
             return result_text
 
         except Exception as e:
@@ -321,18 +620,25 @@ class SyncAgent:
 
         Process:
         1. Classify the query to determine workflow
-        2. Search knowledge base for relevant info
+        2. Search knowledge base for relevant info (in the background)
         3. Check if we need to search emails/orders
         4. Send everything to HF LLM to generate response
+
+        With SEMANTIC_CACHE=1, a documentation question that means the same
+        as a recent one (and names the same order/model numbers) is answered
+        straight from the semantic cache, skipping steps 2-4.
         """
 
+        # Lowercase once - classification and the tool checks both use it
+        query_lower = user_message.lower()
+
         if self.verbose:
             print(f"\n{'='*60}")
             print(f"Processing: {user_message[:50]}...")
             print(f"{'='*60}")
 
             # Step 0: Classify the query
-            workflow_type, category = classify_query(user_message)
+            workflow_type, category = classify_query(query_lower)
             print(f"\n[WORKFLOW DETECTION]")
             if workflow_type == "classification":
                 print(f"  → Query Type: CLASSIFICATION WORKFLOW")
@@ -343,59 +649,109 @@ class SyncAgent:
                 print(f"  → Category: {category}")
                 print(f"  → This query will use general knowledge base search")
 
-            # Step 1: Get relevant docs from knowledge base
-            print(f"\n[STEP 1: SEARCHING KNOWLEDGE BASE]")
-            print(f"  → Querying vector store for relevant documents...")
         else:
             # Still classify for consistency, just don't print
-            workflow_type, category = classify_query(user_message)
+            workflow_type, category = classify_query(query_lower)
+
+        wants_emails = bool(EMAIL_TRIGGER_RE.search(query_lower)) or "@" in user_message
+        wants_orders = bool(ORDER_TRIGGER_RE.search(query_lower))
+
+        # Semantic cache - only for documentation questions that stand on
+        # their own. Email/order answers depend on the customer's data, and
+        # a vague follow-up ("how long does that take?") on the conversation.
+        query_embedding = None
+        if SEMANTIC_CACHE_ENABLED and not (wants_emails or wants_orders) and (
+            workflow_type == "classification" or not self.conversation_history
+        ):
+            normalized_query = " ".join(query_lower.split())
+            query_entities = frozenset(ENTITY_RE.findall(normalized_query))
+            query_embedding = self._cached_embed(normalized_query)
+            cached_answer = self._semantic_lookup(query_embedding, query_entities)
+
+            if cached_answer is not None:
+                self.conversation_history.append({
+                    "user": user_message,
+                    "assistant": cached_answer
+                })
 
-        relevant_docs = self.search_knowledge_base(user_message)
+                if self.verbose:
+                    print(f"\n[SEMANTIC CACHE HIT]")
+                    print(f"  → A recent question meant the same thing - reusing its answer")
+                    print(f"\n[WORKFLOW COMPLETE]")
+                    print(f"{'='*60}\n")
 
-        if self.verbose:
-            print(f"  ✓ Found relevant documentation from knowledge base")
+                return cached_answer
+
+        # Step 1: Get relevant docs from knowledge base (if worth searching)
+        if needs_knowledge_base(user_message, workflow_type):
+            if self.verbose:
+                print(f"\n[STEP 1: SEARCHING KNOWLEDGE BASE]")
+                print(f"  → Querying vector store for relevant documents...")
+
+            # Start the vector search on a worker thread right away, so it
+            # runs while the MCP tools below wait on the network
+            kb_search = asyncio.create_task(
+                asyncio.to_thread(self.search_knowledge_base, user_message)
+            )
+        else:
+            kb_search = None
+            relevant_docs = "No documentation needed for this message."
+
+            if self.verbose:
+                print(f"\n[STEP 1: SKIPPING KNOWLEDGE BASE]")
+                print(f"  → Short message with no support keywords")
 
         # Step 2: Check if we need to search emails or orders
-        additional_context = ""
-        query_lower = user_message.lower()
+        tool_calls = []  # (tool name, search query, context heading)
 
         # Check for email-related queries
-        if any(word in query_lower for word in ["email", "conversation", "ticket", "support history"]) or "@" in user_message:
+        if wants_emails:
             if self.verbose:
                 print(f"\n[STEP 2: CHECKING MCP TOOLS - EMAILS]")
                 print(f"  → Detected email-related query")
                 print(f"  → Calling MCP tool: search_emails")
-            try:
-                # Extract email address if present, or use keywords
-                email_match = re.search(r'[\w\.-]+@[\w\.-]+', user_message)
-                search_query = email_match.group(0) if email_match else user_message
 
-                result = await self.mcp_session.call_tool("search_emails", {"query": search_query})
-                additional_context += f"\n\nCustomer Email History:\n{result.content[0].text}\n"
-                if self.verbose:
-                    print(f"  ✓ Retrieved email data from MCP server")
-            except Exception as e:
-                if self.verbose:
-                    print(f"  ✗ Email search failed: {e}")
+            # Extract email address if present, or use keywords
+            email_match = EMAIL_RE.search(user_message)
+            search_query = email_match.group(0) if email_match else user_message
+            tool_calls.append(("search_emails", search_query, "Customer Email History"))
 
         # Check for order-related queries
-        if any(word in query_lower for word in ["order", "shipping", "delivery", "tracking", "ord-"]):
+        if wants_orders:
             if self.verbose:
                 print(f"\n[STEP 2: CHECKING MCP TOOLS - ORDERS]")
                 print(f"  → Detected order-related query")
                 print(f"  → Calling MCP tool: search_orders")
-            try:
-                # Extract order ID if present, or use keywords
-                order_match = re.search(r'ORD-\d+', user_message, re.IGNORECASE)
-                search_query = order_match.group(0) if order_match else user_message
 
-                result = await self.mcp_session.call_tool("search_orders", {"query": search_query})
-                additional_context += f"\n\nOrder Information:\n{result.content[0].text}\n"
-                if self.verbose:
-                    print(f"  ✓ Retrieved order data from MCP server")
-            except Exception as e:
+            # Extract order ID if present, or use keywords
+            order_match = ORDER_ID_RE.search(user_message)
+            search_query = order_match.group(0) if order_match else user_message
+            tool_calls.append(("search_orders", search_query, "Order Information"))
+
+        # Run the tool calls at the same time instead of one after another.
+        # return_exceptions=True keeps one failed call from losing the other.
+        tool_results = await asyncio.gather(
+            *(self._call_search_tool(tool, search_query) for tool, search_query, _ in tool_calls),
+            return_exceptions=True
+        )
+
+        additional_context = ""
+        for (tool, _, heading), result in zip(tool_calls, tool_results):
+            if isinstance(result, Exception):
                 if self.verbose:
-                    print(f"  ✗ Order search failed: {e}")
+                    print(f"  ✗ {tool} failed: {result}")
+                continue
+
+            additional_context += f"\n\n{heading}:\n{result}\n"
+            if self.verbose:
+                print(f"  ✓ Retrieved {tool} results from MCP server")
+
+        # Collect the knowledge base results started in Step 1
+        if kb_search is not None:
+            relevant_docs = await kb_search
+
+            if self.verbose:
+                print(f"  ✓ Found relevant documentation from knowledge base")
 
         # Step 3: Build prompt for LLM
         if self.verbose:
@@ -409,10 +765,14 @@ class SyncAgent:
         history_context = ""
         if self.conversation_history:
             history_lines = []
-            for exchange in self.conversation_history[-self.max_history:]:
+            for exchange in self.conversation_history:
                 history_lines.append(f"Customer: {exchange['user']}")
                 history_lines.append(f"Agent: {exchange['assistant']}")
-            history_context = "\n".join(history_lines)
+            # Over budget? Drop the oldest exchanges first - the latest
+            # one matters most for a follow-up question
+            while len(history_lines) > 2 and len("\n".join(history_lines)) > HISTORY_CHAR_BUDGET:
+                del history_lines[:2]
+            history_context = fit_to_budget("\n".join(history_lines), HISTORY_CHAR_BUDGET)
 
         system_prompt = """You are a helpful OmniTech customer support agent.
 
@@ -445,45 +805,27 @@ JSON Response:"""
             history_section = f"\nPrevious Conversation:\n{history_context}\n"
 
         full_prompt = system_prompt.format(
-            docs=relevant_docs,
-            context=additional_context,
+            docs=fit_to_budget(relevant_docs, DOCS_CHAR_BUDGET),
+            context=fit_to_budget(additional_context, TOOLS_CHAR_BUDGET),
             history_section=history_section,
             question=user_message
         )
 
-        # Step 4: Get LLM response
-        llm_response = self.query_llm(full_prompt)
+        # Step 4: Get LLM response (on a worker thread, so the event loop
+        # stays free while we wait on Hugging Face)
+        llm_response = await asyncio.to_thread(self.query_llm, full_prompt)
 
         # Step 5: Parse response (handle JSON wrapped in markdown)
-        result = None
-        try:
-            result = json.loads(llm_response)
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown code blocks (```json ... ```)
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', llm_response, re.DOTALL)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group(1))
-                except json.JSONDecodeError:
-                    pass
-
-            # Also try to find raw JSON object in the response
-            if result is None:
-                json_match = re.search(r'\{[^{}]*"response"[^{}]*\}', llm_response, re.DOTALL)
-                if json_match:
-                    try:
-                        result = json.loads(json_match.group(0))
-                    except json.JSONDecodeError:
-                        pass
-
-            # Fallback if no valid JSON found
-            if result is None:
-                clean_response = re.sub(r'```(?:json)?|```', '', llm_response).strip()
-                result = {
-                    "response": clean_response[:500] if len(clean_response) > 500 else clean_response,
-                    "action_needed": "none",
-                    "confidence": 0.6
-                }
+        result = extract_json(llm_response)
+
+        # Fallback if no valid JSON found
+        if result is None:
+            clean_response = CODE_FENCE_RE.sub('', llm_response).strip()
+            result = {
+                "response": clean_response[:500] if len(clean_response) > 500 else clean_response,
+                "action_needed": "none",
+                "confidence": 0.6
+            }
 
         # Extract just the response text
         final_response = result.get("response", "I'm sorry, I couldn't generate a proper response.")
@@ -493,9 +835,11 @@ JSON Response:"""
             "user": user_message,
             "assistant": final_response
         })
-        # Keep only the last max_history exchanges
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history = self.conversation_history[-self.max_history:]
+
+        # Remember real LLM answers (query_llm only caches those, never the
+        # "not configured" / "warming up" fallbacks) for similar questions
+        if query_embedding is not None and prompt_key(full_prompt) in self._llm_cache:
+            self._semantic_cache.append((query_embedding, query_entities, final_response))
 
         if self.verbose:
             print(f"  ✓ LLM response received and parsed")
@@ -571,6 +915,5 @@ async def interactive_agent():
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(interactive_agent())
 
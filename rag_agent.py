@@ -7,11 +7,16 @@ Complete agent with:
 """
 
 import asyncio
+import hashlib
 import json
 import logging
 import re
 import sys
-from contextlib import AsyncExitStack
+import threading
+import time
+from collections import deque
+from contextlib import AsyncExitStack, suppress
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
@@ -23,8 +28,14 @@ except ImportError:
     print("MCP not installed. Install with: pip install mcp")
     sys.exit(1)
 
+# Optional: uvloop is a faster drop-in asyncio event loop (not on Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 import os
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +53,43 @@ if not HF_TOKEN:
     print("Get a token from: https://huggingface.co/settings/tokens")
     print()
 
+# LLM response cache - repeat questions reuse a recent answer instead of
+# waiting on the model again
+LLM_CACHE_SIZE = 128      # LLM responses to remember
+LLM_CACHE_TTL = 300       # Seconds before a cached LLM response goes stale
+CUSTOMER_CACHE_SIZE = 256  # Customer lookups to remember
+CUSTOMER_CACHE_TTL = 60   # Seconds before a cached customer lookup goes stale
+TOOL_CACHE_SIZE = 256     # MCP tool results to remember
+TOOL_CACHE_TTL = 300      # Seconds before a cached tool result goes stale
+
+# MCP tools whose answer depends only on their arguments, so a recent result
+# can be reused. Customer, ticket and stats tools read live data and are not
+# on the list.
+CACHEABLE_TOOLS = {
+    "classify_query",
+    "get_query_template",
+    "list_categories",
+    "search_knowledge",
+    "search_knowledge_batch",
+    "get_knowledge_for_query",
+}
+# Set AGENT_TOOL_CACHE=0 to send every tool call to the server (e.g. to watch
+# the server's own request stats)
+TOOL_CACHE_ENABLED = os.environ.get("AGENT_TOOL_CACHE", "1") != "0"
+
+# Knowledge searches that arrive while another is in flight share one MCP
+# round-trip (a search with nothing ahead of it is sent right away)
+SEARCH_BATCH_WINDOW = 0.01  # Most seconds a queued search waits for its batch
+SEARCH_BATCH_SIZE = 16      # Most searches sent in one batch
+
+# Attach the full LLM prompt to each result for the Gradio "LLM Prompt" view.
+# Set AGENT_DEBUG_PROMPTS=0 to leave it out and keep result dicts small.
+INCLUDE_LLM_PROMPT = os.environ.get("AGENT_DEBUG_PROMPTS", "1") != "0"
+
+# Set SKIP_WARMUP=1 to skip the startup LLM warm-up ping (e.g. in CI, or
+# when the model is known to be loaded already)
+LLM_WARMUP = os.environ.get("SKIP_WARMUP") != "1"
+
 # Support detection keywords (for routing decision)
 
 # ╔══════════════════════════════════════════════════════════════════════════╗
@@ -57,25 +105,17 @@ CYAN = "\033[36m"
 YELLOW = "\033[33m"
 RESET = "\033[0m"
 
+# LLM reply parsing
+JSON_DECODER = json.JSONDecoder()
+CODE_FENCE_RE = re.compile(r'```(?:json)?|```')  # Leftover ``` markers (compiled once)
+
 # ╔══════════════════════════════════════════════════════════════════════════╗
 # ║ 2. Helper Functions                                                      ║
 # ╚══════════════════════════════════════════════════════════════════════════╝
 
-def is_support_query(query: str) -> bool:
-    query_lower = query.lower()
-
-    # Check for support-related keywords
-    for category, keywords in SUPPORT_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in query_lower:
-                return True
-
-
-    for pattern in support_patterns:
-        if re.search(pattern, query_lower):
-            return True
-
-    return False
+def is_support_query(query: str, query_lower: str = None) -> bool:
+    # Check for support-related keywords and question patterns in one pass
+    return SUPPORT_RE.search(query_lower or query.lower()) is not None
 
 
 def unwrap_mcp_result(obj):
@@ -89,6 +129,45 @@ def unwrap_mcp_result(obj):
     return obj
 
 
+def extract_json(text: str) -> Optional[Dict]:
+    """
+    Find the {"response": ...} object in an LLM reply.
+
+    Decodes from each "{" in turn with raw_decode, which stops at the end of
+    the object - one linear pass, nested objects work, no regex backtracking.
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = JSON_DECODER.raw_decode(text, start)
+            if isinstance(obj, dict) and "response" in obj:
+                return obj
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+async def drain_stream(stream):
+    """
+    Read an LLM stream to the end and throw the rest away.
+
+    AsyncInferenceClient only closes a stream's HTTP session once the stream
+    has been read to the end, so a stream we stop reading early still has to
+    be finished somewhere - here, in the background.
+    """
+    try:
+        async for _ in stream:
+            pass
+    except Exception:
+        pass  # The answer was already returned - nothing left to report
+
+
+# Exchanges finished inside process_queries(), held back until the whole batch
+# is done so every query in it sees the same conversation history
+PENDING_EXCHANGES: ContextVar = ContextVar("pending_exchanges", default=None)
+
+
 # ╔══════════════════════════════════════════════════════════════════════════╗
 # ║ 3. RAG Agent Class                                                       ║
 # ╚══════════════════════════════════════════════════════════════════════════╝
@@ -99,18 +178,30 @@ class OmniTechAgent:
     def __init__(self):
         self.session: Optional[ClientSession] = None
         self.exit_stack: Optional[AsyncExitStack] = None
-        self.mcp_calls_log: List[Dict] = []
+        self.mcp_calls_log: deque = deque(maxlen=20)
         self.available_tools: List[str] = []
 
-        self.conversation_history: List[Dict[str, str]] = []
         self.max_history = 3  # Keep last 3 exchanges
+        self.conversation_history: deque = deque(maxlen=self.max_history)
 
-        self.security_log: List[Dict] = []
         self.max_security_log = 50  # Keep last 50 security events
+        self.security_log: deque = deque(maxlen=self.max_security_log)
+
+        self._llm_cache: Dict[str, tuple] = {}
+        self._customer_cache: Dict[str, tuple] = {}
+        self._pending_searches: List[tuple] = []
+        self._search_timer: Optional[asyncio.TimerHandle] = None
+        self._searches_in_flight = 0
+        self._tool_cache: Dict[tuple, tuple] = {}
+        self._history_context: Optional[str] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._background_tasks: set = set()
 
     def clear_history(self):
         """Clear conversation history to start a fresh conversation."""
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self._history_context = None
+        self._customer_cache.clear()
         logger.info("Conversation history cleared")
 
     # ─── Security Methods ─────────────────────────────────────────────────
@@ -128,10 +219,6 @@ class OmniTechAgent:
             "customer_email": customer_email
         }
 
-        # Keep log bounded
-        if len(self.security_log) > self.max_security_log:
-            self.security_log = self.security_log[-self.max_security_log:]
-
         # Also log to standard logger for server-side visibility
         log_msg = f"[SECURITY:{severity.upper()}] {event_type}: {details}"
         if severity == "high":
@@ -139,10 +226,11 @@ class OmniTechAgent:
         else:
             logger.info(log_msg)
 
-    def _inspect_input(self, query: str, customer_email: str = None) -> Dict[str, Any]:
+    def _inspect_input(self, query: str, customer_email: str = None,
+                       query_lower: str = None) -> Dict[str, Any]:
         """
         """
-        query_lower = query.lower()
+        query_lower = query_lower or query.lower()
         patterns_matched = []
 
 
@@ -166,38 +254,52 @@ class OmniTechAgent:
 
     def get_security_log(self) -> List[Dict]:
         """Return the security log for monitoring."""
-        return self.security_log.copy()
+        return list(self.security_log)
 
     def clear_security_log(self):
         """Clear the security log."""
-        self.security_log = []
+        self.security_log.clear()
         logger.info("Security log cleared")
 
     def _build_history_context(self) -> str:
         """Build conversation history context for prompts."""
+        # Built once per change to the history, not once per query
+        if self._history_context is not None:
+            return self._history_context
+
         if not self.conversation_history:
+            self._history_context = ""
             return ""
 
         history_lines = []
-        for exchange in self.conversation_history[-self.max_history:]:
+        for exchange in self.conversation_history:
             history_lines.append(f"Customer: {exchange['user']}")
             history_lines.append(f"Agent: {exchange['assistant']}")
 
-        return "\nPrevious Conversation:\n" + "\n".join(history_lines) + "\n"
+        self._history_context = "\nPrevious Conversation:\n" + "\n".join(history_lines) + "\n"
+        return self._history_context
 
     def _save_exchange(self, user_message: str, assistant_response: str):
         """Save an exchange to conversation history."""
+        pending = PENDING_EXCHANGES.get()
+        if pending is not None:
+            # Part of a process_queries() batch - saved later, in input order
+            pending.append((user_message, assistant_response))
+            return
+
         self.conversation_history.append({
             "user": user_message,
             "assistant": assistant_response
-        })
-        # Keep only the last max_history exchanges
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history = self.conversation_history[-self.max_history:]
+        })  # The deque drops the oldest exchange once max_history is reached
+        self._history_context = None  # Rebuilt on next use
 
     # ─── MCP Connection ────────────────────────────────────────────────────
 
     async def connect(self) -> bool:
+        # Wake the LLM up in the background while the MCP server starts
+        if HF_CLIENT and LLM_WARMUP:
+            self._warmup_task = asyncio.create_task(self._warm_up_llm())
+
         try:
             self.exit_stack = AsyncExitStack()
 
@@ -210,6 +312,24 @@ class OmniTechAgent:
 
     async def disconnect(self):
         """Clean up MCP connection."""
+        # Stop background work first so nothing is left pending when the loop closes
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        if self._warmup_task:
+            with suppress(asyncio.CancelledError, Exception):
+                await self._warmup_task  # Also collects a finished warm-up's error
+
+        if self._search_timer:
+            self._search_timer.cancel()
+            self._search_timer = None
+        for _, _, future in self._pending_searches:
+            future.cancel()
+        self._pending_searches = []
+
+        for task in list(self._background_tasks):
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+
         if self.exit_stack:
             await self.exit_stack.aclose()
 
@@ -220,12 +340,32 @@ class OmniTechAgent:
         if not self.session:
             raise Exception("MCP session not initialized")
 
-        start_time = datetime.now()
+        # Reuse a recent result of the same call to a read-only tool
+        cache_key = None
+        if TOOL_CACHE_ENABLED and tool_name in CACHEABLE_TOOLS:
+            cache_key = (tool_name, json.dumps(arguments, sort_keys=True))
+            cached = self._tool_cache.get(cache_key)
+            if cached and time.monotonic() - cached[0] < TOOL_CACHE_TTL:
+                # Still log it, so the MCP call log shows every call made
+                self.mcp_calls_log.append({
+                    "timestamp": datetime.now().isoformat(),
+                    "tool": tool_name,
+                    "arguments": arguments,
+                    "duration_ms": 0,
+                    "success": True,
+                    "cached": True
+                })
+                logger.info(f"MCP tool result served from cache ({tool_name})")
+                return cached[1]
+
+        start_time = time.perf_counter()
         try:
             result = await self.session.call_tool(tool_name, arguments)
-            duration = (datetime.now() - start_time).total_seconds()
+            duration = time.perf_counter() - start_time
 
             parsed = unwrap_mcp_result(result)
+            # Failed tools answer with an {"error": ...} dict
+            success = not (isinstance(parsed, dict) and "error" in parsed)
 
             # Log the call
             self.mcp_calls_log.append({
@@ -233,11 +373,16 @@ class OmniTechAgent:
                 "tool": tool_name,
                 "arguments": arguments,
                 "duration_ms": round(duration * 1000, 2),
-                "success": "error" not in str(parsed).lower()
+                "success": success,
+                "cached": False
             })
 
-            if len(self.mcp_calls_log) > 20:
-                self.mcp_calls_log = self.mcp_calls_log[-20:]
+            # Remember successful results (dropping the oldest when full)
+            if cache_key and success:
+                self._tool_cache.pop(cache_key, None)
+                self._tool_cache[cache_key] = (time.monotonic(), parsed)
+                if len(self._tool_cache) > TOOL_CACHE_SIZE:
+                    del self._tool_cache[next(iter(self._tool_cache))]
 
             return parsed
 
@@ -245,6 +390,86 @@ class OmniTechAgent:
             logger.error(f"Tool call failed ({tool_name}): {e}")
             return {"error": str(e)}
 
+    async def search_knowledge(self, query: str, max_results: int = 5) -> Dict[str, Any]:
+        """
+        Search the knowledge base, sharing one MCP call with concurrent searches.
+
+        A search with nothing in flight ahead of it is sent right away. Searches
+        that arrive while one is in flight are queued and go to the server
+        together as one search_knowledge_batch call (which embeds them in one
+        pass) when it finishes, after SEARCH_BATCH_WINDOW at the latest, or as
+        soon as SEARCH_BATCH_SIZE are waiting.
+        """
+        if "search_knowledge_batch" not in self.available_tools:
+            return await self.call_tool("search_knowledge", {
+                "query": query,
+                "max_results": max_results
+            })
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_searches.append((query, max_results, future))
+
+        if not self._searches_in_flight or len(self._pending_searches) >= SEARCH_BATCH_SIZE:
+            # Nothing to wait for, or the batch is full - send now
+            self._start_flush()
+        elif self._search_timer is None:
+            self._search_timer = loop.call_later(SEARCH_BATCH_WINDOW, self._start_flush)
+
+        return await future
+
+    def _start_flush(self):
+        """Run _flush_searches in a task we keep a reference to."""
+        task = asyncio.create_task(self._flush_searches())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _flush_searches(self):
+        """Send every pending search as one search_knowledge_batch call."""
+        # This batch takes everything queued, so a pending timer has nothing left to send
+        if self._search_timer:
+            self._search_timer.cancel()
+            self._search_timer = None
+
+        batch, self._pending_searches = self._pending_searches, []
+        if not batch:
+            return
+
+        self._searches_in_flight += 1
+        try:
+            response = await self.call_tool("search_knowledge_batch", {
+                "queries": [query for query, _, _ in batch],
+                "max_results": max(n for _, n, _ in batch)
+            })
+            if not isinstance(response, dict):
+                raise TypeError(f"Unexpected search_knowledge_batch response: {response!r:.200}")
+
+            results = response.get("results", [])
+            for i, (_, max_results, future) in enumerate(batch):
+                if i < len(results) and isinstance(results[i], dict):
+                    # Trim to what this caller asked for
+                    matches = results[i].get("matches", [])[:max_results]
+                    result = dict(results[i], matches=matches, count=len(matches))
+                else:
+                    result = response  # The batch call failed - pass its error on
+                if not future.done():
+                    future.set_result(result)
+        except BaseException as e:
+            # Whatever went wrong, no caller may be left waiting on its future
+            for _, _, future in batch:
+                if not future.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self._searches_in_flight -= 1
+            # Searches that queued up behind this call go out now
+            if self._pending_searches and not self._searches_in_flight:
+                self._start_flush()
+
     # ─── Customer Context ──────────────────────────────────────────────────
 
     async def get_customer_context(self, email: str) -> str:
@@ -252,6 +477,11 @@ class OmniTechAgent:
         if "lookup_customer" not in self.available_tools:
             return "Customer: Unknown"
 
+        key = email.lower()
+        cached = self._customer_cache.get(key)
+        if cached and time.monotonic() - cached[0] < CUSTOMER_CACHE_TTL:
+            return cached[1]
+
         customer = await self.call_tool("lookup_customer", {"email": email})
 
         if customer.get("found"):
@@ -263,14 +493,31 @@ class OmniTechAgent:
             if tickets > 0:
                 context += f" - {tickets} previous tickets"
 
+            self._customer_cache[key] = (time.monotonic(), context)
+            if len(self._customer_cache) > CUSTOMER_CACHE_SIZE:
+                del self._customer_cache[next(iter(self._customer_cache))]
             return context
         else:
             return f"Customer: {email} (not in database)"
 
     # ─── LLM Integration ───────────────────────────────────────────────────
 
-    def query_llm(self, prompt: str) -> str:
-        """Query HuggingFace Inference API using InferenceClient."""
+    async def _warm_up_llm(self):
+        """
+        Send a tiny request so the model is loaded (no 503 "warming up") by
+        the time the first real question comes.
+        """
+        try:
+            await HF_CLIENT.chat_completion(
+                messages=[{"role": "user", "content": "ping"}],
+                model=HF_MODEL,
+                max_tokens=1
+            )
+        except Exception:
+            pass  # Just a warm-up - query_llm reports real errors
+
+    async def query_llm(self, prompt: str) -> str:
+        """Query HuggingFace Inference API using AsyncInferenceClient."""
         if not HF_CLIENT:
             logger.warning("HF_TOKEN not set. Get a token from https://huggingface.co/settings/tokens")
             return json.dumps({
@@ -279,6 +526,13 @@ class OmniTechAgent:
                 "confidence": 0.7
             })
 
+        # Reuse a recent answer to the exact same prompt
+        cache_key = hashlib.sha256(prompt.encode()).hexdigest()
+        cached = self._llm_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < LLM_CACHE_TTL:
+            logger.info("LLM response served from cache")
+            return cached[1]
+
         try:
 
         except Exception as e:
@@ -299,6 +553,27 @@ class OmniTechAgent:
                 "confidence": 0.7
             })
 
+    @staticmethod
+    def _parse_llm_json(llm_response: str) -> Dict[str, Any]:
+        """
+        Turn an LLM reply into a result dict.
+
+        Finds the {"response": ...} object even when the LLM wraps it in
+        ```json fences or adds text around it. If there is none, the reply
+        text itself becomes the response.
+        """
+        result = extract_json(llm_response)
+        if result is not None:
+            return result
+
+        # Fallback if no valid JSON found
+        clean_response = CODE_FENCE_RE.sub('', llm_response).strip()
+        return {
+            "response": clean_response[:500] if len(clean_response) > 500 else clean_response,
+            "action_needed": "none",
+            "confidence": 0.6
+        }
+
     # ─── Classification Workflow ───────────────────────────────────────────
 
     async def handle_support_query(self, query: str, customer_email: str = None) -> Dict[str, Any]:
@@ -306,15 +581,15 @@ class OmniTechAgent:
 
         """
         workflow_log = []
-        start_time = datetime.now()
+        start_time = time.perf_counter()
 
-        try:
-            # Get customer context if email provided
-            customer_context = ""
-            if customer_email:
-                customer_context = await self.get_customer_context(customer_email)
-                workflow_log.append(f"[INFO] {customer_context}")
+        # Get customer context if email provided - started now so the
+        # lookup runs while the query is being classified
+        customer_task = None
+        if customer_email:
+            customer_task = asyncio.create_task(self.get_customer_context(customer_email))
 
+        try:
             # Step 1: Classify
             workflow_log.append("[1/4] Classifying query...")
             classification = await self.call_tool("classify_query", {"user_query": query})
@@ -326,21 +601,27 @@ class OmniTechAgent:
             confidence = classification.get("confidence", 0)
             workflow_log.append(f"[Result] Category: {category} (confidence: {confidence:.2f})")
 
-            # Step 2: Get template
+            customer_context = ""
+            if customer_task:
+                customer_context = await customer_task
+                workflow_log.insert(0, f"[INFO] {customer_context}")
+
+            # Steps 2 and 3 only need the category, so get the template and
+            # retrieve the knowledge at the same time
             workflow_log.append("[2/4] Getting template...")
-            template_info = await self.call_tool("get_query_template", {"query_name": category})
+            workflow_log.append(f"[3/4] Retrieving knowledge for {category}...")
+            template_info, knowledge_info = await asyncio.gather(
+                self.call_tool("get_query_template", {"query_name": category}),
+                self.call_tool("get_knowledge_for_query", {
+                    "category": category,
+                    "query": query,
+                    "max_results": 3
+                })
+            )
 
             template = template_info.get("template", "") if "error" not in template_info else ""
             description = template_info.get("description", category)
 
-            # Step 3: Retrieve knowledge
-            workflow_log.append(f"[3/4] Retrieving knowledge for {category}...")
-            knowledge_info = await self.call_tool("get_knowledge_for_query", {
-                "category": category,
-                "query": query,
-                "max_results": 3
-            })
-
             knowledge = knowledge_info.get("knowledge", "No documentation found.")
             sources = knowledge_info.get("sources", [])
             workflow_log.append(f"[INFO] Retrieved {len(sources)} source(s)")
@@ -349,39 +630,9 @@ class OmniTechAgent:
             workflow_log.append("[4/4] Generating response...")
 
 
-            llm_response = self.query_llm(full_prompt)
+            llm_response = await self.query_llm(full_prompt)
 
-            # Parse response - handle JSON wrapped in markdown code blocks
-            result = None
-            try:
-                result = json.loads(llm_response)
-            except json.JSONDecodeError:
-                # Try to extract JSON from markdown code blocks (```json ... ```)
-                json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', llm_response, re.DOTALL)
-                if json_match:
-                    try:
-                        result = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        pass
-
-                # Also try to find raw JSON object in the response
-                if result is None:
-                    json_match = re.search(r'\{[^{}]*"response"[^{}]*\}', llm_response, re.DOTALL)
-                    if json_match:
-                        try:
-                            result = json.loads(json_match.group(0))
-                        except json.JSONDecodeError:
-                            pass
-
-                # Fallback if no valid JSON found
-                if result is None:
-                    # Clean up the response - remove JSON artifacts if present
-                    clean_response = re.sub(r'```(?:json)?|```', '', llm_response).strip()
-                    result = {
-                        "response": clean_response[:500] if len(clean_response) > 500 else clean_response,
-                        "action_needed": "none",
-                        "confidence": 0.6
-                    }
+            result = self._parse_llm_json(llm_response)
 
             # Handle knowledge-base-only fallback
             if result.get("response") == "KNOWLEDGE_BASE_ONLY":
@@ -399,10 +650,11 @@ class OmniTechAgent:
             result["workflow"] = "classification"
             result["workflow_log"] = workflow_log
             result["sources"] = sources
-            result["llm_prompt"] = full_prompt
+            if INCLUDE_LLM_PROMPT:
+                result["llm_prompt"] = full_prompt
             result["llm_model"] = HF_MODEL
             result["customer_email"] = customer_email
-            result["processing_time_ms"] = (datetime.now() - start_time).total_seconds() * 1000
+            result["processing_time_ms"] = (time.perf_counter() - start_time) * 1000
 
             workflow_log.append("[SUCCESS] Response generated")
             return result
@@ -415,23 +667,29 @@ class OmniTechAgent:
                 "workflow": "classification",
                 "workflow_log": workflow_log
             }
+        finally:
+            # Don't leave the customer lookup running if we returned or
+            # failed before its result was needed
+            if customer_task and not customer_task.done():
+                customer_task.cancel()
+                await asyncio.gather(customer_task, return_exceptions=True)
 
 
     async def handle_exploratory_query(self, query: str, customer_email: str = None) -> Dict[str, Any]:
         """Handle exploratory queries using direct RAG search."""
-        start_time = datetime.now()
+        start_time = time.perf_counter()
 
-        try:
-            # Get customer context if email provided
-            customer_context = ""
-            if customer_email:
-                customer_context = await self.get_customer_context(customer_email)
+        # Get customer context if email provided - started now so the
+        # lookup runs while the knowledge base is searched
+        customer_task = None
+        if customer_email:
+            customer_task = asyncio.create_task(self.get_customer_context(customer_email))
 
+        try:
             # Search across all knowledge
-            search_result = await self.call_tool("search_knowledge", {
-                "query": query,
-                "max_results": 5
-            })
+            search_result = await self.search_knowledge(query, max_results=5)
+
+            customer_context = await customer_task if customer_task else ""
 
             matches = search_result.get("matches", [])
 
@@ -449,48 +707,20 @@ class OmniTechAgent:
 
             # Query LLM
 
-            llm_response = self.query_llm(prompt)
+            llm_response = await self.query_llm(prompt)
 
-            # Parse response - handle JSON wrapped in markdown code blocks
-            result = None
-            try:
-                result = json.loads(llm_response)
-            except json.JSONDecodeError:
-                # Try to extract JSON from markdown code blocks (```json ... ```)
-                json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', llm_response, re.DOTALL)
-                if json_match:
-                    try:
-                        result = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        pass
-
-                # Also try to find raw JSON object in the response
-                if result is None:
-                    json_match = re.search(r'\{[^{}]*"response"[^{}]*\}', llm_response, re.DOTALL)
-                    if json_match:
-                        try:
-                            result = json.loads(json_match.group(0))
-                        except json.JSONDecodeError:
-                            pass
-
-                # Fallback if no valid JSON found
-                if result is None:
-                    clean_response = re.sub(r'```(?:json)?|```', '', llm_response).strip()
-                    result = {
-                        "response": clean_response[:500] if len(clean_response) > 500 else clean_response,
-                        "action_needed": "none",
-                        "confidence": 0.6
-                    }
+            result = self._parse_llm_json(llm_response)
 
             if result.get("response") == "KNOWLEDGE_BASE_ONLY":
                 result["response"] = f"Here's what I found:\n\n{knowledge[:400]}..."
 
             result["workflow"] = "direct_rag"
             result["sources"] = sources
-            result["llm_prompt"] = prompt
+            if INCLUDE_LLM_PROMPT:
+                result["llm_prompt"] = prompt
             result["llm_model"] = HF_MODEL
             result["customer_email"] = customer_email
-            result["processing_time_ms"] = (datetime.now() - start_time).total_seconds() * 1000
+            result["processing_time_ms"] = (time.perf_counter() - start_time) * 1000
 
             # Save this exchange to conversation history
             self._save_exchange(query, result.get("response", ""))
@@ -504,6 +734,12 @@ class OmniTechAgent:
                 "error": str(e),
                 "workflow": "direct_rag"
             }
+        finally:
+            # Don't leave the customer lookup running if we returned or
+            # failed before its result was needed
+            if customer_task and not customer_task.done():
+                customer_task.cancel()
+                await asyncio.gather(customer_task, return_exceptions=True)
 
     # ─── Main Query Handler ────────────────────────────────────────────────
 
@@ -515,6 +751,33 @@ class OmniTechAgent:
         Exploratory queries → Direct RAG search
         """
 
+    async def process_queries(self, items: List[tuple]) -> List[Dict[str, Any]]:
+        """
+        Process several (query, customer_email) pairs concurrently.
+
+        The MCP and LLM round-trips of every query overlap, so a batch takes
+        about as long as its slowest query. Results come back in input order.
+        The queries are independent: each sees the history from before the
+        batch, and their exchanges are added to it afterwards in input order.
+        """
+        async def run_one(query: str, customer_email: str):
+            # Each gathered task has its own context, so this list only
+            # collects this query's exchange
+            pending = []
+            PENDING_EXCHANGES.set(pending)
+            result = await self.process_query(query, customer_email)
+            return result, pending
+
+        outcomes = await asyncio.gather(
+            *(run_one(query, customer_email) for query, customer_email in items)
+        )
+
+        for _, pending in outcomes:
+            for user_message, assistant_response in pending:
+                self._save_exchange(user_message, assistant_response)
+
+        return [result for result, _ in outcomes]
+
     # ─── Server Stats ──────────────────────────────────────────────────────
 
     async def get_server_stats(self) -> Dict[str, Any]:
@@ -535,14 +798,18 @@ class SyncAgent:
     def __init__(self):
         self.agent = OmniTechAgent()
         self.loop = None
+        self._thread = None
         self._initialize()
 
     def _initialize(self):
         """Initialize async components."""
         try:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-            success = self.loop.run_until_complete(self.agent.connect())
+            # Run the event loop on its own thread, so calls from several
+            # Gradio worker threads share it and their MCP calls overlap
+            self.loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self._thread.start()
+            success = self.run(self.agent.connect())
             if not success:
                 raise Exception("Failed to connect to MCP server")
             logger.info("SyncAgent initialized successfully")
@@ -550,17 +817,25 @@ class SyncAgent:
             logger.error(f"Initialization failed: {e}")
             raise
 
+    def run(self, coro):
+        """Run a coroutine on the agent's event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
     def process_query(self, query: str, customer_email: str = None) -> Dict[str, Any]:
         """Synchronous query processing."""
         if not self.loop:
             return {"error": "Agent not initialized", "response": "System error"}
-        return self.loop.run_until_complete(
-            self.agent.process_query(query, customer_email)
-        )
+        return self.run(self.agent.process_query(query, customer_email))
+
+    def process_queries_batch(self, items: List[tuple]) -> List[Dict[str, Any]]:
+        """Synchronous batch processing of (query, customer_email) pairs."""
+        if not self.loop:
+            return [{"error": "Agent not initialized", "response": "System error"} for _ in items]
+        return self.run(self.agent.process_queries(items))
 
     def get_mcp_log(self) -> List[Dict]:
         """Get MCP call log."""
-        return self.agent.mcp_calls_log
+        return list(self.agent.mcp_calls_log)
 
     def clear_history(self):
         """Clear conversation history."""
@@ -570,7 +845,7 @@ class SyncAgent:
         """Get server stats."""
         if not self.loop:
             return {"error": "Agent not initialized"}
-        return self.loop.run_until_complete(self.agent.get_server_stats())
+        return self.run(self.agent.get_server_stats())
 
     def get_available_tools(self) -> List[str]:
         """Get list of available MCP tools."""
@@ -588,7 +863,9 @@ class SyncAgent:
         """Cleanup."""
         if self.loop and self.agent:
             try:
-                self.loop.run_until_complete(self.agent.disconnect())
+                self.run(self.agent.disconnect())
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self._thread.join(timeout=5)
                 self.loop.close()
             except:
                 pass
@@ -640,6 +917,8 @@ async def interactive_mode():
             if user_input.lower() == "exit":
                 break
             elif user_input.lower() == "demo":
+                # One at a time, so each query sees the ones before it in
+                # its conversation history
                 for q in sample_queries:
                     print(f"\n{GREEN}Query:{RESET} {q}")
                     result = await agent.process_query(q, customer_email)
@@ -683,5 +962,8 @@ async def interactive_mode():
 
 
 if __name__ == "__main__":
-    asyncio.run(interactive_mode())
+    if uvloop:
+        uvloop.run(interactive_mode())
+    else:
+        asyncio.run(interactive_mode())
 
@@ -100,13 +100,13 @@ mcp>=1.22.0
 chromadb>=0.4.0
 
 # PDF processing
-pypdf>=5.0.0
+pymupdf>=1.26.6
 
 # Gradio UI (usually pre-installed on HF Spaces, but specify version)
 gradio>=4.19.0
 
-# HuggingFace Hub for LLM inference
-huggingface_hub>=0.20.0
+# HuggingFace Hub for LLM inference ([inference] adds what AsyncInferenceClient needs)
+huggingface_hub[inference]>=0.20.0
 
 # Sentence transformers for embeddings (used by ChromaDB)
 sentence-transformers>=2.2.0
@@ -215,8 +215,9 @@ __pycache__/
 *.py[cod]
 *.so
 
-# Database (will be created at runtime)
+# Database and vector store (will be created at runtime)
 *.db
+.chroma/
 
 # Logs
 *.log